@@ -1,36 +1,100 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from icalendar import Calendar, Event
-from lxml import html
-import requests
-
-from datetime import datetime, timedelta, UTC
+from lxml import etree, html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests_cache
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, UTC
+from itertools import islice
+from operator import itemgetter
 import argparse
 import logging
 import re
 
 
 MAX_SPAN_DAYS = 10
+MAX_FETCH_WORKERS = 4
+
+# (dtstart, serialized VEVENT block)
+Event = tuple[date, str]
+
+_CALENDAR_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    "PRODID:-//ru-prodcal-ics//Ru Non-Working Days Calendar//EN\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+    "METHOD:PUBLISH\r\n"
+    "NAME:Ru Non-Working Days\r\n"
+    "X-WR-CALNAME:Ru Non-Working Days\r\n"
+)
+_CALENDAR_FOOTER = "END:VCALENDAR\r\n"
+
+_DAY_NUM_RE = re.compile(r"^(\d{1,2})\b")
+_CLASSIFY_RE = re.compile(r"(?P<short>Предпраздничный день)|Выходной день(?P<holiday>\.)?")
+
+_XP_MONTHS = etree.XPath(
+    "//div[@class='calendar-list__item__title' or @class='calendar-list__item-title']/.."
+)
+_XP_DAYS = etree.XPath(".//li[contains(@class,'calendar-list__numbers__item')]")
+
+HTTP_CACHE_NAME = ".prodcal_http_cache"
+
+
+def make_session() -> requests_cache.CachedSession:
+    # Responses are revalidated with ETag/Last-Modified once the cached copy expires
+    session = requests_cache.CachedSession(
+        HTTP_CACHE_NAME,
+        backend="filesystem",
+        expire_after=86400,
+        cache_control=True,
+    )
+    session.headers.update({"User-Agent": "curl/7.68.0"})
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=MAX_FETCH_WORKERS,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[500, 502, 503, 504],
+            ),
+        ),
+    )
+    return session
 
 
-def fetch_page(year: int) -> bytes | None:
+def fetch_page(session: requests_cache.CachedSession, year: int) -> html.HtmlElement | None:
     url = f"https://hh.ru/article/calendar{year}"
     logging.info(url)
 
-    headers = {"User-Agent": "curl/7.68.0"}
-    r = requests.get(url, headers=headers, allow_redirects=True, timeout=20)
+    r = session.get(url, allow_redirects=True, timeout=20)
 
     if r.status_code == 404:
         logging.warning("No calendar page for year %d (404)", year)
         return None
 
     r.raise_for_status()
-    return r.content
+
+    parser = html.HTMLParser(
+        collect_ids=False,
+        remove_blank_text=True,
+        remove_comments=True,
+    )
+    parser.feed(r.content)
+    tree = parser.close()
+
+    # Drop subtrees the XPath queries never look into
+    etree.strip_elements(tree, "script", "style", "noscript", "svg", with_tail=False)
+    return tree
 
 
 def normalize_text(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").strip())
+    return " ".join(s.split()) if s else ""
 
 
 def classify_day(hint: str) -> str | None:
@@ -41,30 +105,21 @@ def classify_day(hint: str) -> str | None:
       - 'shortened'
     or None (working day)
     """
-    hint = normalize_text(hint)
+    m = _CLASSIFY_RE.match(normalize_text(hint))
+    if not m:
+        return None
 
-    if hint.startswith("Предпраздничный день"):
+    if m["short"]:
         return "shortened"
 
-    if hint.startswith("Выходной день."):
+    if m["holiday"]:
         return "holiday"
 
-    if hint.startswith("Выходной день"):
-        return "dayoff"
-
-    return None
-
-
-def parse_year(year: int) -> list[dict] | None:
-    content = fetch_page(year)
-    if content is None:
-        return None
+    return "dayoff"
 
-    tree = html.fromstring(content)
 
-    months = tree.xpath(
-        "//div[@class='calendar-list__item__title' or @class='calendar-list__item-title']/.."
-    )
+def parse_year(year: int, tree: html.HtmlElement) -> list[dict]:
+    months = _XP_MONTHS(tree)
 
     if len(months) != 12:
         raise RuntimeError(
@@ -77,16 +132,23 @@ def parse_year(year: int) -> list[dict] | None:
     for m in months:
         month_map: dict[int, str] = {}
 
-        days = m.xpath(".//li[contains(@class,'calendar-list__numbers__item')]")
+        days = _XP_DAYS(m)
         for li in days:
-            text = normalize_text(li.text_content())
-            mday = re.match(r"^(\d{1,2})\b", text)
-            if not mday:
-                continue
-
-            day = int(mday.group(1))
-            hint_nodes = li.xpath(".//div[contains(@class,'calendar-hint')]//text()")
-            hint = normalize_text(" ".join(hint_nodes))
+            raw = (li.text or "").strip()
+            if raw.isdecimal():
+                day = int(raw)
+            else:
+                # Day number is not the leading text node, scan the whole cell
+                mday = _DAY_NUM_RE.match(normalize_text(li.text_content()))
+                if not mday:
+                    continue
+                day = int(mday.group(1))
+
+            hint = ""
+            for div in li.iter("div"):
+                if "calendar-hint" in div.get("class", ""):
+                    hint = normalize_text(" ".join(div.itertext()))
+                    break
 
             kind = classify_day(hint)
             if kind:
@@ -102,14 +164,15 @@ def group_consecutive(days: list[int]) -> list[list[int]]:
     if not days:
         return []
 
-    days = sorted(days)
-    groups = [[days[0]]]
+    groups: list[list[int]] = []
+    run: list[int] = []
 
-    for d in days[1:]:
-        if d == groups[-1][-1] + 1:
-            groups[-1].append(d)
+    for d in sorted(days):
+        if run and d == run[-1] + 1:
+            run.append(d)
         else:
-            groups.append([d])
+            run = [d]
+            groups.append(run)
 
     return groups
 
@@ -118,49 +181,58 @@ def split_chunks(run: list[int]) -> list[list[int]]:
     return [run[i:i + MAX_SPAN_DAYS] for i in range(0, len(run), MAX_SPAN_DAYS)]
 
 
-def make_event(year, month, d1, d2, summary):
-    e = Event()
-    e.add("summary", summary)
-    e.add("dtstart", datetime(year, month, d1).date())
-    e.add("dtend", datetime(year, month, d2).date() + timedelta(days=1))
-    e.add("dtstamp", datetime.now(UTC))
-    e.add("uid", f"ru-prodcal-{year}{month:02d}{d1:02d}-{d2:02d}-{summary.lower().replace(' ', '-')}")
-    return e
+def make_event(year, month, d1, d2, summary, dtstamp: str) -> Event:
+    # All-day events with fixed ASCII summaries: every line stays well under
+    # 75 octets and needs neither folding nor escaping
+    start = date(year, month, d1)
+    end = date(year, month, d2) + timedelta(days=1)
+    uid = f"ru-prodcal-{year}{month:02d}{d1:02d}-{d2:02d}-{summary.lower().replace(' ', '-')}"
+
+    return start, (
+        "BEGIN:VEVENT\r\n"
+        f"SUMMARY:{summary}\r\n"
+        f"DTSTART;VALUE=DATE:{start:%Y%m%d}\r\n"
+        f"DTEND;VALUE=DATE:{end:%Y%m%d}\r\n"
+        f"DTSTAMP:{dtstamp}\r\n"
+        f"UID:{uid}\r\n"
+        "END:VEVENT\r\n"
+    )
 
 
-def generate_events(year: int, months: list[dict]) -> list[Event]:
+def generate_events(year: int, months: list[dict], dtstamp: str) -> list[Event]:
     events: list[Event] = []
 
     for month, days_map in enumerate(months, start=1):
+        buckets: dict[str, list[int]] = {
+            "holiday": [],
+            "dayoff": [],
+            "shortened": [],
+        }
+        for d, k in days_map.items():
+            buckets[k].append(d)
+
         for kind, summary in [
             ("holiday", "Holiday"),
             ("dayoff", "Day off"),
             ("shortened", "* Shortened workday"),
         ]:
-            days = [d for d, k in days_map.items() if k == kind]
-
-            for run in group_consecutive(days):
+            for run in group_consecutive(buckets[kind]):
                 for chunk in split_chunks(run):
                     events.append(
-                        make_event(year, month, chunk[0], chunk[-1], summary)
+                        make_event(year, month, chunk[0], chunk[-1], summary, dtstamp)
                     )
 
     return events
 
 
-def build_calendar(events: list[Event]) -> Calendar:
-    cal = Calendar()
-    cal.add("prodid", "-//ru-prodcal-ics//Ru Non-Working Days Calendar//EN")
-    cal.add("version", "2.0")
-    cal.add("calscale", "GREGORIAN")
-    cal.add("method", "PUBLISH")
-    cal.add("NAME", "Ru Non-Working Days")
-    cal.add("X-WR-CALNAME", "Ru Non-Working Days")
+def build_calendar(events: list[Event]) -> bytes:
+    out = [_CALENDAR_HEADER]
 
-    for e in sorted(events, key=lambda x: x.decoded("dtstart")):
-        cal.add_component(e)
+    for _, vevent in sorted(events, key=itemgetter(0)):
+        out.append(vevent)
 
-    return cal
+    out.append(_CALENDAR_FOOTER)
+    return "".join(out).encode("utf-8")
 
 
 def main():
@@ -177,19 +249,45 @@ def main():
         datefmt="%Y-%m-%d %H:%M:%S",
     )
 
+    # All events of one run share the generation instant
+    dtstamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%SZ")
     events: list[Event] = []
+    years = range(args.start_year, args.end_year + 1)
+    session = make_session()
+
+    workers = max(1, min(MAX_FETCH_WORKERS, len(years)))
+    pending_years = iter(years)
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        # Keep at most `workers` pages in flight and consume them in year
+        # order, so only a few DOMs are alive at once and nothing fetched
+        # after the first missing year can fail the run
+        pending = deque(
+            (year, ex.submit(fetch_page, session, year))
+            for year in islice(pending_years, workers)
+        )
+
+        while pending:
+            year, future = pending.popleft()
+            tree = future.result()
+            if tree is None:
+                logging.info("Stopping at year %d (no data yet)", year)
+                break
+
+            next_year = next(pending_years, None)
+            if next_year is not None:
+                pending.append((next_year, ex.submit(fetch_page, session, next_year)))
+
+            events.extend(generate_events(year, parse_year(year, tree), dtstamp))
+            del tree, future
 
-    for year in range(args.start_year, args.end_year + 1):
-        months = parse_year(year)
-        if not months:
-            logging.info("Stopping at year %d (no data yet)", year)
-            break
-        events.extend(generate_events(year, months))
+        for _, future in pending:
+            future.cancel()
 
-    cal = build_calendar(events)
+    ics = build_calendar(events)
 
     with open(args.o, "wb") as f:
-        f.write(cal.to_ical())
+        f.write(ics)
 
 
 if __name__ == "__main__":